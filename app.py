@@ -1,6 +1,7 @@
-from flask import Flask, render_template, Response, jsonify, request
+from quart import Quart, render_template, Response, jsonify, request
 from object_detector import ObjectDetector
 from tts import speak
+import asyncio
 import numpy as np
 import cv2
 import base64
@@ -14,30 +15,58 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-app = Flask(__name__)
+app = Quart(__name__)
 detector = ObjectDetector()
 
 @app.route('/')
-def index():
+async def index():
     """Render the main interface"""
     app.logger.info("Serving index page")
-    return render_template('index.html')
+    return await render_template('index.html')
 
 @app.route('/video_feed')
-def video_feed():
+async def video_feed():
     """Video streaming route that serves the processed frames"""
     app.logger.info("Video feed endpoint accessed")
-    return Response(
-        detector.generate_frames(),
+
+    async def stream():
+        loop = asyncio.get_event_loop()
+        # Frames come from the detector's single shared queue, so
+        # concurrent viewers split the frame rate between them; one
+        # viewer is the supported mode.
+        # Track viewers so the detector can skip annotation and encode
+        # entirely when nobody is watching
+        detector.add_subscriber()
+        try:
+            while detector.running:
+                # get_jpeg blocks on the detector's queue, so run it in the
+                # default executor to keep the event loop free
+                jpeg = await loop.run_in_executor(None, detector.get_jpeg)
+                if jpeg is None:
+                    continue
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            detector.remove_subscriber()
+
+    response = Response(
+        stream(),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
+    # Quart applies RESPONSE_TIMEOUT (60s) to response sending; a live
+    # stream must never be cut off
+    response.timeout = None
+    return response
 
 @app.route('/start', methods=['POST'])
-def start_detection():
+async def start_detection():
     """Start the object detection system"""
     app.logger.info("Start detection request received")
     if not detector.running:
-        success = detector.start_detection()
+        # Camera probing and worker spawn block for seconds; keep them
+        # off the event loop
+        loop = asyncio.get_event_loop()
+        success = await loop.run_in_executor(None, detector.start_detection)
         return jsonify({
             "status": "started" if success else "error",
             "message": "Detection started" if success else "Failed to start detection"
@@ -45,21 +74,23 @@ def start_detection():
     return jsonify({"status": "already running", "message": "Detection is already running"})
 
 @app.route('/stop', methods=['POST'])
-def stop_detection():
+async def stop_detection():
     """Stop the object detection system"""
     app.logger.info("Stop detection request received")
     if detector.running:
-        detector.stop_detection()
+        # stop_detection joins the pipeline threads; run it off-loop too
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, detector.stop_detection)
         return jsonify({"status": "stopped", "message": "Detection stopped"})
     return jsonify({"status": "not running", "message": "Detection is not running"})
 
 @app.route('/status')
-def detection_status():
+async def detection_status():
     """Check if detection is running"""
     return jsonify({"running": detector.running})
 
 @app.route('/test_tts', methods=['POST'])
-def test_tts():
+async def test_tts():
     """Test the text-to-speech functionality"""
     try:
         speak("This is a test voice alert")
@@ -76,4 +107,4 @@ def test_tts():
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)
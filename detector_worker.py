@@ -0,0 +1,113 @@
+"""YOLO inference in a separate process, fed over shared memory.
+
+Set DETECTOR_WORKER=1 before starting the app to route inference
+through a subprocess, so the CPU-bound model never contends with the
+pipeline and web threads for the GIL. Frames and results move through
+multiprocessing.shared_memory slots instead of being pickled.
+"""
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+MAX_DETECTIONS = 64  # Rows in the result slot: x1, y1, x2, y2, cls
+DETECT_TIMEOUT = 2.0  # Seconds to wait for the worker per frame
+
+
+def _worker_main(frame_name, result_name, frame_ready, result_ready,
+                 stop_event, height, width):
+    """Subprocess entry point: run inference over the shared frame slot"""
+    # Import here so torch/ultralytics initialize in the child process
+    import os
+    import torch
+    from ultralytics import YOLO
+
+    frame_shm = shared_memory.SharedMemory(name=frame_name)
+    result_shm = shared_memory.SharedMemory(name=result_name)
+    frame = np.ndarray((height, width, 3), dtype=np.uint8,
+                       buffer=frame_shm.buf)
+    result = np.ndarray((1 + MAX_DETECTIONS * 5,), dtype=np.int32,
+                        buffer=result_shm.buf)
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device == 'cpu' and os.path.exists("yolov8n.int8.onnx"):
+        model = YOLO("yolov8n.int8.onnx")
+    else:
+        model = YOLO("yolov8n.pt").to(device)
+    # Warm-up so the first real frame is not slow
+    model.predict(np.zeros((height, width, 3), np.uint8), conf=0.5,
+                  imgsz=320, device=device, verbose=False)
+
+    while not stop_event.is_set():
+        if not frame_ready.wait(timeout=0.5):
+            continue
+        frame_ready.clear()
+        try:
+            results = model.predict(frame, conf=0.5, imgsz=320,
+                                    device=device,
+                                    half=(device == 'cuda'), verbose=False)
+            boxes = results[0].boxes if results else []
+            n = min(len(boxes), MAX_DETECTIONS)
+            result[0] = n
+            if n > 0:
+                packed = result[1:1 + n * 5].reshape(n, 5)
+                packed[:, :4] = boxes.xyxy.cpu().numpy().astype(np.int32)[:n]
+                packed[:, 4] = boxes.cls.cpu().numpy().astype(np.int32)[:n]
+        except Exception as e:
+            logging.error(f"Worker inference error: {e}")
+            result[0] = 0
+        result_ready.set()
+
+    frame_shm.close()
+    result_shm.close()
+
+
+class WorkerClient:
+    """Parent-side handle for the inference subprocess"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.frame_shm = shared_memory.SharedMemory(
+            create=True, size=height * width * 3)
+        self.result_shm = shared_memory.SharedMemory(
+            create=True, size=(1 + MAX_DETECTIONS * 5) * 4)
+        self.frame = np.ndarray((height, width, 3), dtype=np.uint8,
+                                buffer=self.frame_shm.buf)
+        self.result = np.ndarray((1 + MAX_DETECTIONS * 5,), dtype=np.int32,
+                                 buffer=self.result_shm.buf)
+
+        ctx = mp.get_context('spawn')
+        self.frame_ready = ctx.Event()
+        self.result_ready = ctx.Event()
+        self.stop_event = ctx.Event()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(self.frame_shm.name, self.result_shm.name,
+                  self.frame_ready, self.result_ready, self.stop_event,
+                  height, width),
+            daemon=True)
+        self.process.start()
+
+    def detect(self, frame):
+        """Run one frame through the worker; returns (xyxy, cls_ids)"""
+        np.copyto(self.frame, frame)
+        self.result_ready.clear()
+        self.frame_ready.set()
+        if not self.result_ready.wait(timeout=DETECT_TIMEOUT):
+            logging.warning("Detector worker timed out")
+            return np.empty((0, 4), np.int32), np.empty(0, np.int32)
+        n = int(self.result[0])
+        packed = self.result[1:1 + n * 5].reshape(n, 5)
+        return packed[:, :4].copy(), packed[:, 4].copy()
+
+    def close(self):
+        """Stop the subprocess and release the shared memory"""
+        self.stop_event.set()
+        self.process.join(timeout=2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.frame_shm.close()
+        self.frame_shm.unlink()
+        self.result_shm.close()
+        self.result_shm.unlink()
@@ -0,0 +1,19 @@
+"""One-time export of yolov8n.pt to int8 ONNX for faster CPU inference.
+
+Run once before deployment:
+    python export_model.py
+ObjectDetector picks up yolov8n.int8.onnx automatically when it exists.
+"""
+from ultralytics import YOLO
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+
+def main():
+    YOLO("yolov8n.pt").export(format="onnx", imgsz=320, half=False)
+    quantize_dynamic("yolov8n.onnx", "yolov8n.int8.onnx",
+                     weight_type=QuantType.QInt8)
+    print("Wrote yolov8n.int8.onnx")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,52 @@
+import os
+
+# Cap library thread pools before cv2/torch are imported; the pipeline
+# is already threaded and OpenMP/MKL oversubscription thrashes the cores
+os.environ.setdefault("OMP_NUM_THREADS", "4")
+os.environ.setdefault("MKL_NUM_THREADS", "4")
+os.environ.setdefault("OPENBLAS_NUM_THREADS", "1")
+
 import cv2
 import numpy as np
+import torch
 from ultralytics import YOLO
 import time
 import logging
-from threading import Lock
-from tts import speak
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+from detector_worker import WorkerClient
+from tts import try_speak
+
+try:
+    # SIMD JPEG encoding via libjpeg-turbo when the library is installed
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+try:
+    # Compiled fast path (python setup.py build_ext --inplace)
+    from postprocess import build_annotations
+except ImportError:
+    def build_annotations(xyxy, focal, known_w, safe):
+        """NumPy fallback when the Cython extension is not built"""
+        widths = xyxy[:, 2] - xyxy[:, 0]
+        distances = np.where(widths > 0,
+                             (known_w * focal) / np.maximum(widths, 1),
+                             0).astype(np.float32)
+        unsafe = (distances < safe).astype(np.uint8)
+        return distances, unsafe
 
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Leave the cores to inference: OpenCV only does resize/draw/encode here
+cv2.setNumThreads(1)
+torch.set_num_threads(max(1, (os.cpu_count() or 2) - 2))
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    pass  # Can only be set once per process
+
 
 class ObjectDetector:
     def __init__(self):
@@ -22,6 +60,8 @@ class ObjectDetector:
         self.FRAME_HEIGHT = 480  # Output frame height
         self.FPS_TARGET = 24  # Target frames per second
         self.FRAME_SKIP = 2  # Process every Nth frame (for performance)
+        self.QUEUE_SIZE = 2  # Bounded queue depth between pipeline stages
+        self.MAX_GRAB_FAILURES = 5  # Consecutive failures before reopening
 
         # Alert configuration
         self.CONTINUOUS_ALERT_INTERVAL = 2.0  # Seconds between repeat alerts
@@ -33,131 +73,359 @@ class ObjectDetector:
         self.running = False  # Detection running flag
         self.lock = Lock()  # Thread safety lock
         self.frame_count = 0  # Frame counter
+        self.cap_lock = Lock()  # Guards grab/retrieve/reopen on self.cap
+        self.frame_ready = Event()  # Signals a fresh frame was grabbed
+        self.write_q = None  # Annotated frames awaiting JPEG encode
+        self.jpeg_q = None  # Encoded JPEG bytes ready to stream
+        self.threads = []  # Pipeline worker threads
         self.last_alert_time = 0  # Last time any alert was played
-        self.tracked_objects = {}  # {obj_type: {'distance': float,
-        #             'last_seen': float,
-        #             'last_alert': float}}
+        self.subscribers = 0  # Connected /video_feed clients
+        self.sub_lock = Lock()  # Guards the subscriber count
+        self.jpeg_quality = 70  # Current encode quality (adaptive)
+        self._encode_ewma = 0.0  # Smoothed JPEG encode time (seconds)
+
+        # Optional inference subprocess (set DETECTOR_WORKER=1); keeps
+        # the CPU-bound model off this process's GIL entirely
+        self.USE_WORKER = os.environ.get("DETECTOR_WORKER", "0") == "1"
+        self.worker = None  # WorkerClient handle while running
+
+        # JPEG encoder: libjpeg-turbo when available, cv2.imencode otherwise
+        self.turbo = None
+        if TurboJPEG is not None:
+            try:
+                self.turbo = TurboJPEG()
+                logging.info("TurboJPEG encoder loaded")
+            except Exception as e:
+                logging.warning(f"TurboJPEG unavailable, using cv2.imencode: {e}")
+
+        # Rotating resize destinations - a single shared buffer would be
+        # overwritten while earlier frames still sit in write_q or are
+        # being encoded, so keep one per frame possibly in flight.
+        # Frames stay BGR end-to-end (capture -> annotate -> encode);
+        # the single BGR->RGB swap for the model happens inside predict,
+        # fused with its NCHW copy
+        self._frame_bufs = [
+            np.empty((self.FRAME_HEIGHT, self.FRAME_WIDTH, 3), np.uint8)
+            for _ in range(self.QUEUE_SIZE + 2)]
+        self._buf_idx = 0
+
+        # Pick the fastest available device once at startup
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-        # Initialize YOLO model
+        # Initialize YOLO model; prefer the int8 ONNX export when present
+        # (run export_model.py once) - ONNXRuntime int8 is much faster on CPU
         try:
-            self.model = YOLO("yolov8n.pt").to('cpu')
-            logging.info("YOLO model loaded successfully")
+            loaded_pt = False
+            if self.device == 'cpu' and os.path.exists("yolov8n.int8.onnx"):
+                self.model = YOLO("yolov8n.int8.onnx")
+                logging.info("Quantized ONNX model loaded successfully")
+            else:
+                self.model = YOLO("yolov8n.pt").to(self.device)
+                logging.info(f"YOLO model loaded on {self.device}")
+                loaded_pt = True
+
+            # Warm-up pass so the first streamed frame is not slow; the
+            # worker subprocess does its own warm-up, the parent model is
+            # then only used for class names
+            if not self.USE_WORKER:
+                self._frame_bufs[0].fill(0)
+                self.model.predict(self._frame_bufs[0], conf=0.5, imgsz=320,
+                                   device=self.device,
+                                   half=(self.device == 'cuda'),
+                                   verbose=False)
+                if loaded_pt:
+                    self._specialize_model()
         except Exception as e:
             logging.error(f"Error loading YOLO model: {e}")
             raise
 
+        # Per-class tracking state indexed by class id (no dict churn on
+        # the hot path; distance is inf while a class is untracked)
+        self._names = self._load_names()
+        n_classes = len(self._names)
+
+        # Per-class label prefixes, so the hot loop only appends digits
+        self._label_tmpl = tuple((f"{name} - UNSAFE (", f"{name} - SAFE (")
+                                 for name in self._names)
+        self._td_dist = np.full(n_classes, np.inf, dtype=np.float32)
+        self._td_last_seen = np.zeros(n_classes, dtype=np.float64)
+        self._td_last_alert = np.zeros(n_classes, dtype=np.float64)
+
+    def _load_names(self):
+        """Resolve the class-name mapping as a tuple.
+
+        For ONNX weights model.names is None until the backend is built;
+        after the warm-up predict the names live on the backend, and in
+        the worker branch (no warm-up here) they have to come from the
+        original .pt weights instead.
+        """
+        names = self.model.names
+        if not names and self.model.predictor is not None:
+            names = self.model.predictor.model.names
+        if not names:
+            names = YOLO("yolov8n.pt").names
+        return tuple(names[i] for i in range(len(names)))
+
+    def _specialize_model(self):
+        """Compile the live network for the fixed 320x320 batch-1 shape.
+
+        Must run after the warm-up predict: compiling self.model.model
+        beforehand is useless, because AutoBackend's fuse() unwraps the
+        compiled module and the predictor runs the eager network. Swap
+        the module on the built backend instead, which is what forward
+        actually calls.
+        """
+        if not hasattr(torch, 'compile'):
+            return
+        try:
+            backend = self.model.predictor.model  # AutoBackend
+            backend.model = torch.compile(backend.model,
+                                          mode='reduce-overhead')
+            # torch.compile is lazy; run one pass at the serving shape
+            # so the first streamed frame does not pay for compilation
+            self.model.predict(self._frame_bufs[0], conf=0.5, imgsz=320,
+                               device=self.device,
+                               half=(self.device == 'cuda'), verbose=False)
+            logging.info("Model compiled with torch.compile")
+        except Exception as e:
+            logging.warning(f"torch.compile failed, staying eager: {e}")
+
     def estimate_distance(self, pixel_width):
         """Estimate distance to object using pixel width"""
         if pixel_width == 0:
             return 0
         return (self.KNOWN_WIDTH_CM * self.FOCAL_LENGTH) / pixel_width
 
+    def _detect(self, frame):
+        """Run inference and return (xyxy, cls_ids) as int32 arrays"""
+        if self.worker is not None:
+            return self.worker.detect(frame)
+
+        results = self.model.predict(frame, conf=0.5, imgsz=320,
+                                     device=self.device,
+                                     half=(self.device == 'cuda'),
+                                     verbose=False)
+        if not results or len(results[0].boxes) == 0:
+            return np.empty((0, 4), np.int32), np.empty(0, np.int32)
+
+        # Pull all boxes out of the tensors at once instead of
+        # crossing the PyTorch->Python boundary per box
+        boxes = results[0].boxes
+        xyxy = np.ascontiguousarray(
+            boxes.xyxy.cpu().numpy().astype(np.int32))
+        cls_ids = boxes.cls.cpu().numpy().astype(np.int32)
+        return xyxy, cls_ids
+
     def process_frame(self, frame):
         """Process a single frame for object detection and alerts"""
         try:
-            # Skip processing some frames for better performance
-            self.frame_count += 1
-            if self.frame_count % self.FRAME_SKIP != 0:
-                return frame
-
-            # Resize and detect objects
-            frame = cv2.resize(frame, (self.FRAME_WIDTH, self.FRAME_HEIGHT))
-            results = self.model.predict(frame, conf=0.5, imgsz=320, verbose=False)
+            # Camera is already configured to FRAME_WIDTHxFRAME_HEIGHT in
+            # start_detection; only resize if it delivered something else
+            if (frame.shape[1] != self.FRAME_WIDTH or
+                    frame.shape[0] != self.FRAME_HEIGHT):
+                self._buf_idx = (self._buf_idx + 1) % len(self._frame_bufs)
+                frame = cv2.resize(frame,
+                                   (self.FRAME_WIDTH, self.FRAME_HEIGHT),
+                                   dst=self._frame_bufs[self._buf_idx],
+                                   interpolation=cv2.INTER_AREA)
+            xyxy, cls_ids = self._detect(frame)
 
             current_time = time.time()
-            annotated = frame.copy()
-            current_objects = {}
-
-            if results and len(results[0].boxes) > 0:
-                for box in results[0].boxes:
-                    # Extract object information
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    pixel_width = x2 - x1
-                    distance = self.estimate_distance(pixel_width)
-                    obj_type = self.model.names[int(box.cls)]
-                    current_objects[obj_type] = distance
-
-                    # Visual feedback
-                    if distance < self.SAFE_DISTANCE_CM:
-                        color = (0, 0, 255)  # Red for unsafe
-                        label = f"{obj_type} - UNSAFE ({int(distance)}cm)"
-                    else:
-                        color = (0, 255, 0)  # Green for safe
-                        label = f"{obj_type} - SAFE ({int(distance)}cm)"
-
-                    # Draw bounding box and label
-                    cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
-                    cv2.putText(annotated, label, (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+            # Annotate in place; the raw frame is never reused downstream
+            annotated = frame
+            distances = np.empty(0, dtype=np.float32)
+
+            if len(cls_ids) > 0:
+                distances, unsafe = build_annotations(
+                    xyxy, float(self.FOCAL_LENGTH),
+                    float(self.KNOWN_WIDTH_CM), float(self.SAFE_DISTANCE_CM))
+                # Remaining loop only draws, and only for actual viewers
+                if self.subscribers > 0:
+                    for (x1, y1, x2, y2), cls_id, distance, is_unsafe in zip(
+                            xyxy.tolist(), cls_ids.tolist(),
+                            distances.tolist(), unsafe.tolist()):
+                        # Visual feedback
+                        if is_unsafe:
+                            color = (0, 0, 255)  # Red for unsafe
+                            label = self._label_tmpl[cls_id][0] + f"{int(distance)}cm)"
+                        else:
+                            color = (0, 255, 0)  # Green for safe
+                            label = self._label_tmpl[cls_id][1] + f"{int(distance)}cm)"
+
+                        # Draw bounding box and label
+                        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+                        cv2.putText(annotated, label, (x1, y1 - 10),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
             # Update tracked objects and trigger alerts
-            self.update_tracked_objects(current_objects, current_time)
+            self.update_tracked_objects(cls_ids, distances, current_time)
             self.trigger_alerts(current_time)
 
+            if self.subscribers == 0:
+                return None  # Nobody is streaming; skip the encode stage
             return annotated
         except Exception as e:
             logging.error(f"Error processing frame: {e}")
             return frame
 
-    def update_tracked_objects(self, current_objects, current_time):
-        """Maintain state of tracked objects"""
-        # Update existing objects
-        for obj_type in list(self.tracked_objects.keys()):
-            if obj_type in current_objects:
-                self.tracked_objects[obj_type]['distance'] = current_objects[obj_type]
-                self.tracked_objects[obj_type]['last_seen'] = current_time
-            elif current_time - self.tracked_objects[obj_type]['last_seen'] > self.ALERT_PERSISTENCE:
-                del self.tracked_objects[obj_type]  # Remove stale objects
-
-        # Add new objects
-        for obj_type, distance in current_objects.items():
-            if obj_type not in self.tracked_objects:
-                self.tracked_objects[obj_type] = {
-                    'distance': distance,
-                    'last_seen': current_time,
-                    'last_alert': 0  # Never alerted before
-                }
+    def update_tracked_objects(self, cls_ids, distances, current_time):
+        """Maintain per-class tracking state"""
+        # Expire classes unseen for longer than ALERT_PERSISTENCE; a
+        # reappearing class alerts immediately, as a fresh object would
+        expired = (current_time - self._td_last_seen) > self.ALERT_PERSISTENCE
+        self._td_dist[expired] = np.inf
+        self._td_last_alert[expired] = 0
+
+        # Record the classes seen this frame
+        if len(cls_ids) > 0:
+            self._td_dist[cls_ids] = distances
+            self._td_last_seen[cls_ids] = current_time
 
     def trigger_alerts(self, current_time):
         """Trigger voice alerts for unsafe objects"""
-        for obj_type, data in self.tracked_objects.items():
-            if data['distance'] < self.SAFE_DISTANCE_CM:
-                # Check if time for a new alert
-                if (current_time - data['last_alert'] >= self.CONTINUOUS_ALERT_INTERVAL and
-                        current_time - self.last_alert_time >= self.MIN_ALERT_GAP):
-                    speak(f"Warning! {obj_type} at {int(data['distance'])} centimeters")
-                    self.tracked_objects[obj_type]['last_alert'] = current_time
-                    self.last_alert_time = current_time
-
-    def generate_frames(self):
-        """Generator function for video frames"""
+        due = np.where(
+            (self._td_dist < self.SAFE_DISTANCE_CM) &
+            (current_time - self._td_last_alert >= self.CONTINUOUS_ALERT_INTERVAL))[0]
+        for cls_id in due:
+            # Enforce the minimum gap between any two alerts
+            if current_time - self.last_alert_time < self.MIN_ALERT_GAP:
+                break
+            distance = self._td_dist[cls_id]
+            obj_type = self._names[cls_id]
+            if not try_speak(f"Warning! {obj_type} at {int(distance)} centimeters"):
+                break  # Speaker saturated; retry on a later frame
+            self._td_last_alert[cls_id] = current_time
+            self.last_alert_time = current_time
+
+    def _configure_camera(self):
+        """Apply stream settings to the open capture device"""
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.FRAME_WIDTH)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.FRAME_HEIGHT)
+        self.cap.set(cv2.CAP_PROP_FPS, self.FPS_TARGET)
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        # MJPEG from the camera instead of raw YUY2: far less USB
+        # bandwidth and no CPU color conversion in the driver path
+        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+
+    def _grab_loop(self):
+        """Pipeline stage 1: keep the camera buffer drained
+
+        cap.grab() pulls a frame off the driver queue without decoding
+        it; the detector decodes via cap.retrieve() only when ready, so
+        it always works on the freshest frame and skipped frames are
+        never even decoded.
+        """
+        failures = 0
         while self.running:
             try:
                 if self.cap is None or not self.cap.isOpened():
                     time.sleep(0.1)
                     continue
 
-                ret, frame = self.cap.read()
-                if not ret:
-                    logging.warning("Frame read failed, reinitializing camera")
-                    self.cap.release()
-                    self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+                with self.cap_lock:
+                    grabbed = self.cap.grab()
+                if not grabbed:
+                    # Retry transient glitches; reopening costs hundreds
+                    # of ms, so only do it after repeated failures
+                    failures += 1
+                    if failures < self.MAX_GRAB_FAILURES:
+                        time.sleep(0.05)
+                        continue
+                    logging.warning("Camera unresponsive, reinitializing")
+                    with self.cap_lock:
+                        self.cap.release()
+                        self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+                        self._configure_camera()
+                    failures = 0
                     time.sleep(0.1)
                     continue
+                failures = 0
+
+                # Only flag every FRAME_SKIP-th frame for decoding
+                self.frame_count += 1
+                if self.frame_count % self.FRAME_SKIP == 0:
+                    self.frame_ready.set()
+            except Exception as e:
+                logging.error(f"Error grabbing frame: {e}")
+                time.sleep(0.1)
+
+    def _get_latest(self):
+        """Decode the most recently grabbed frame, or None on timeout"""
+        if not self.frame_ready.wait(timeout=0.5):
+            return None
+        self.frame_ready.clear()
+        with self.cap_lock:
+            ret, frame = self.cap.retrieve()
+        return frame if ret else None
+
+    def _detector_loop(self):
+        """Pipeline stage 2: run detection on the latest grabbed frame"""
+        while self.running:
+            try:
+                frame = self._get_latest()
+                if frame is None:
+                    continue
 
                 processed_frame = self.process_frame(frame)
-                ret, buffer = cv2.imencode('.jpg', processed_frame,
-                                           [int(cv2.IMWRITE_JPEG_QUALITY), 70])
-                if not ret:
+                if processed_frame is None:
                     continue
+                self.write_q.put(processed_frame, timeout=0.5)
+            except Full:
+                continue  # Encoder is behind, drop the frame
+            except Exception as e:
+                logging.error(f"Error in detection stage: {e}")
 
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+    def _encoder_loop(self):
+        """Pipeline stage 3: JPEG-encode processed frames"""
+        while self.running:
+            try:
+                frame = self.write_q.get(timeout=0.5)
+            except Empty:
+                continue
+            try:
+                start = time.time()
+                if self.turbo is not None:
+                    jpeg = self.turbo.encode(frame, quality=self.jpeg_quality,
+                                             pixel_format=TJPF_BGR)
+                else:
+                    ret, buffer = cv2.imencode(
+                        '.jpg', frame,
+                        [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
+                    if not ret:
+                        continue
+                    jpeg = buffer.tobytes()
+
+                # Step quality down when encode eats into the frame
+                # budget, back up once it recovers
+                self._encode_ewma = (0.9 * self._encode_ewma +
+                                     0.1 * (time.time() - start))
+                if self._encode_ewma > 0.5 / self.FPS_TARGET:
+                    self.jpeg_quality = 50
+                elif self._encode_ewma < 0.25 / self.FPS_TARGET:
+                    self.jpeg_quality = 70
 
-                time.sleep(1 / self.FPS_TARGET)
+                self.jpeg_q.put(jpeg, timeout=0.5)
+            except Full:
+                continue  # Client is behind, drop the frame
             except Exception as e:
-                logging.error(f"Error in frame generation: {e}")
-                break
+                logging.error(f"Error encoding frame: {e}")
+
+    def add_subscriber(self):
+        """Register a /video_feed client"""
+        with self.sub_lock:
+            self.subscribers += 1
+
+    def remove_subscriber(self):
+        """Unregister a /video_feed client"""
+        with self.sub_lock:
+            self.subscribers = max(0, self.subscribers - 1)
+
+    def get_jpeg(self, timeout=0.5):
+        """Return the next encoded JPEG frame, or None on timeout"""
+        try:
+            return self.jpeg_q.get(timeout=timeout)
+        except Empty:
+            return None
 
     def start_detection(self):
         """Start the object detection system"""
@@ -175,12 +443,31 @@ class ObjectDetector:
                         return False
 
                     # Optimize camera settings
-                    self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.FRAME_WIDTH)
-                    self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.FRAME_HEIGHT)
-                    self.cap.set(cv2.CAP_PROP_FPS, self.FPS_TARGET)
-                    self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                    self._configure_camera()
+
+                    if self.USE_WORKER:
+                        self.worker = WorkerClient(self.FRAME_WIDTH,
+                                                   self.FRAME_HEIGHT)
+                        logging.info("Detector worker process started")
+
+                    # Bounded queues provide backpressure between stages;
+                    # they must exist before running flips, since clients
+                    # poll get_jpeg as soon as running is True
+                    self.write_q = Queue(maxsize=self.QUEUE_SIZE)
+                    self.jpeg_q = Queue(maxsize=self.QUEUE_SIZE)
+                    self.frame_ready.clear()
 
                     self.running = True
+
+                    # Spawn the grabber -> detector -> encoder pipeline
+                    self.threads = [
+                        Thread(target=self._grab_loop, daemon=True),
+                        Thread(target=self._detector_loop, daemon=True),
+                        Thread(target=self._encoder_loop, daemon=True)
+                    ]
+                    for thread in self.threads:
+                        thread.start()
+
                     logging.info("Detection started successfully")
                     return True
                 except Exception as e:
@@ -193,9 +480,17 @@ class ObjectDetector:
         with self.lock:
             self.running = False
             try:
+                for thread in self.threads:
+                    thread.join(timeout=1.0)
+                self.threads = []
+                if self.worker is not None:
+                    self.worker.close()
+                    self.worker = None
                 if self.cap and self.cap.isOpened():
                     self.cap.release()
-                self.tracked_objects.clear()
+                self._td_dist.fill(np.inf)
+                self._td_last_seen.fill(0)
+                self._td_last_alert.fill(0)
                 logging.info("Detection stopped")
             except Exception as e:
                 logging.error(f"Error stopping detection: {e}")
\ No newline at end of file
@@ -0,0 +1,26 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+import numpy as np
+
+
+cpdef tuple build_annotations(int[:, ::1] xyxy, float focal, float known_w,
+                              float safe):
+    """Compute per-box distances and unsafe flags from xyxy boxes"""
+    cdef int n = xyxy.shape[0]
+    distances_arr = np.zeros(n, dtype=np.float32)
+    unsafe_arr = np.zeros(n, dtype=np.uint8)
+    cdef float[::1] distances = distances_arr
+    cdef unsigned char[::1] unsafe = unsafe_arr
+    cdef int i, w
+    cdef float d
+
+    with nogil:
+        for i in range(n):
+            w = xyxy[i, 2] - xyxy[i, 0]
+            if w > 0:
+                d = (known_w * focal) / w
+            else:
+                d = 0
+            distances[i] = d
+            unsafe[i] = 1 if d < safe else 0
+
+    return distances_arr, unsafe_arr
@@ -0,0 +1,9 @@
+from setuptools import setup
+from Cython.Build import cythonize
+
+# Build the postprocessing extension in place:
+#   python setup.py build_ext --inplace
+setup(
+    name="postprocess",
+    ext_modules=cythonize("postprocess.pyx", language_level=3),
+)
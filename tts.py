@@ -1,12 +1,47 @@
 import pyttsx3
+import queue
 import threading
-def speak(text):
-    def run_speak():
+
+_q = queue.Queue()
+
+
+def _speaker_loop():
+    try:
+        engine = pyttsx3.init()
+        engine.setProperty('rate', 150)
+    except Exception as e:
+        print(f"TTS init error: {e}")
+        return
+    while True:
+        text = _q.get()
         try:
-            engine = pyttsx3.init()
-            engine.setProperty('rate', 150)
             engine.say(text)
             engine.runAndWait()
         except Exception as e:
             print(f"TTS error: {e}")
-    threading.Thread(target=run_speak, daemon=True).start()
+
+
+# Single long-lived engine: pyttsx3.init() loads the speech driver,
+# which is far too slow to repeat on every alert
+_speaker = threading.Thread(target=_speaker_loop, daemon=True)
+_speaker.start()
+
+
+MAX_PENDING = 2  # Drop alerts rather than queueing a stale backlog
+
+
+def queue_size():
+    """Number of alerts waiting on the speaker"""
+    return _q.qsize()
+
+
+def try_speak(text):
+    """Enqueue an alert unless the speaker is saturated; returns success"""
+    if _q.qsize() >= MAX_PENDING:
+        return False
+    _q.put(text)
+    return True
+
+
+def speak(text):
+    _q.put(text)